@@ -1,16 +1,17 @@
 import argparse
 import datetime
 import time
-import json
 import os
 import cv2
 import numpy as np
 
-from common import RecorderConfig
+from common import RecorderConfig, save_depth
+from proxy import save_proxy
+from recording import Recording
 
 def save_clipped_data(recorded_colors: np.ndarray, recorded_depths: np.ndarray, out_dir: str, config: RecorderConfig):
     """
-    録画したデータをRGB, Depth, JSONの3つに保存する
+    録画したデータをRGB, Depth, JSONの3つとプロキシに保存する
     """
     save_start = time.time()
     if os.path.exists(out_dir) is False:
@@ -20,16 +21,16 @@ def save_clipped_data(recorded_colors: np.ndarray, recorded_depths: np.ndarray,
     config.color_file = f"{config.time_str}-rgb.avi"
     config.time_sec = recorded_colors.shape[0] / config.frequency
 
+    # プロキシの保存(JSONにファイル名を書き込むため先に保存する)
+    save_proxy(recorded_colors, recorded_depths, out_dir, config)
+
     # JSONの保存
     with open(str(os.path.join(out_dir, f"{config.time_str}.json")), "w") as f:
         f.write(config.toJson())
 
     # Depthの保存
     depth_path = str(os.path.join(out_dir, config.depth_file))
-    np.savez_compressed(
-        depth_path,
-        recorded_depths
-    )
+    save_depth(depth_path, recorded_depths)
 
     # RGBの保存
     color_path = str(os.path.join(out_dir, config.color_file))
@@ -40,32 +41,19 @@ def save_clipped_data(recorded_colors: np.ndarray, recorded_depths: np.ndarray,
     writer.release()
     print(f"saved: {time.time() - save_start}s")
 
-def clip_frame(color_file: str, depth_file: str, start: int, end: int, out_dir: str, config: RecorderConfig):
+def clip_frame(recording: Recording, start: int, end: int, out_dir: str):
     """
     動画データをクリップして保存する
     """
-    video = cv2.VideoCapture(color_file)
-
-    depth_frames = np.load(depth_file)
-    depth_frames = depth_frames[depth_frames.files[0]]
-    depth_frames = depth_frames[start:end]
-
-    current_frame = 0
+    clipped = recording[start:end]
+    config = recording.config
 
-    color_frame = None
+    color_frames = np.zeros((len(clipped), config.height, config.width, 3), dtype=np.uint8)
+    depth_frames = np.zeros((len(clipped), config.height, config.width), dtype=np.uint16)
 
-    color_frames = np.zeros((end-start, config.height, config.width, 3), dtype=np.uint8)
-
-    try:
-        while True:
-            ret, color_frame = video.read()
-            if current_frame >= start and current_frame < end:
-                color_frames[current_frame-start,:,:,:] = color_frame
-            current_frame += 1
-            if current_frame >= end:
-                break
-    finally:
-        video.release()
+    for i, (color_frame, depth_frame) in enumerate(clipped.iter_frames()):
+        color_frames[i,:,:,:] = color_frame
+        depth_frames[i,:,:] = depth_frame
 
     save_clipped_data(color_frames, depth_frames, out_dir, config)
 
@@ -76,16 +64,7 @@ if __name__ == "__main__":
     parser.add_argument("end", help="end frame", type=int)
     parser.add_argument("-o", "--out", default=".", help="out directory")
     args = parser.parse_args()
-    json_path = args.json
-    out_dir = args.out
-    dir = os.path.split(os.path.abspath(json_path))[0]
-    with open(json_path) as f:
-        config_dic = json.load(f)
-        config = RecorderConfig.fromJson(config_dic)
-        print(config_dic)
-
-    color_path = os.path.join(dir, config_dic["color_file"])
-    depth_path = os.path.join(dir, config_dic["depth_file"])
-    frequency = config_dic["frequency"]
+    recording = Recording(args.json)
+    print(recording.config.toJson())
 
-    clip_frame(color_path, depth_path, args.start, args.end, out_dir, config)
+    clip_frame(recording, args.start, args.end, args.out)
@@ -1,5 +1,11 @@
+from collections import OrderedDict
 from enum import Enum, auto
+import glob
 import json
+import os
+import zipfile
+import cv2
+import numpy as np
 
 class DisplayMethod(Enum):
     STACK = auto()
@@ -9,7 +15,7 @@ class RecorderConfig():
     """
     レコーダの設定(主にjsonで出力する用途)
     """
-    def __init__(self, width: int, height: int, time_sec: float, frequency: int, display: DisplayMethod, intrinsics_color = None, intrinsics_depth = None) -> None:
+    def __init__(self, width: int, height: int, time_sec: float, frequency: int, display: DisplayMethod, intrinsics_color = None, intrinsics_depth = None, depth_scale: float = None) -> None:
         self.width: int = width
         self.height: int = height
         self.time_sec: float = time_sec
@@ -18,8 +24,12 @@ class RecorderConfig():
         self.time_str: str = None
         self.depth_file: str = None
         self.color_file: str = None
+        self.proxy_color_file: str = None
+        self.proxy_depth_file: str = None
         self.intrinsics_color = intrinsics_color
         self.intrinsics_depth = intrinsics_depth
+        # Depthの1単位あたりのメートル
+        self.depth_scale: float = depth_scale
 
     def toJson(self) -> str :
         encoded = json.dumps({
@@ -30,6 +40,9 @@ class RecorderConfig():
             "time": self.time_str,
             "depth_file": self.depth_file,
             "color_file": self.color_file,
+            "depth_scale": self.depth_scale,
+            "proxy_color_file": self.proxy_color_file,
+            "proxy_depth_file": self.proxy_depth_file,
             "intrinsics_color": self.intrinsics_color if isinstance(self.intrinsics_color, dict) else {
                 "fx": self.intrinsics_color.fx,
                 "fy": self.intrinsics_color.fy,
@@ -55,12 +68,230 @@ class RecorderConfig():
 
     @classmethod
     def fromJson(cls, decoded: dict):
-        return cls(
+        config = cls(
             width=decoded["width"],
             height=decoded["height"],
             time_sec=decoded["time_sec"],
             frequency=decoded["frequency"],
             display=None,
             intrinsics_color= decoded.get("intrinsics_color"),
-            intrinsics_depth= decoded.get("intrinsics_depth")
-        )
\ No newline at end of file
+            intrinsics_depth= decoded.get("intrinsics_depth"),
+            depth_scale= decoded.get("depth_scale")
+        )
+        config.time_str = decoded.get("time")
+        config.depth_file = decoded.get("depth_file")
+        config.color_file = decoded.get("color_file")
+        config.proxy_color_file = decoded.get("proxy_color_file")
+        config.proxy_depth_file = decoded.get("proxy_depth_file")
+        return config
+
+def colorize_depth(depth_frame: np.ndarray) -> np.ndarray:
+    return cv2.applyColorMap(
+        cv2.convertScaleAbs(depth_frame, alpha=0.08), cv2.COLORMAP_JET
+    )
+
+def compose_view(color_frame: np.ndarray, depth_frame: np.ndarray, display: DisplayMethod) -> np.ndarray:
+    """
+    ColorとDepthを表示方法(上下に並べる/重ねる)に合わせて1枚の画像にする
+    """
+    depth_colormap = colorize_depth(depth_frame)
+    if display == DisplayMethod.STACK:
+        return np.vstack((depth_colormap, color_frame))
+    img_mask = cv2.bitwise_not(cv2.inRange(depth_colormap, np.array([128,0,0]), np.array([128,0,0])))
+    depth_colormap = cv2.bitwise_and(depth_colormap, depth_colormap, mask=img_mask)
+    return cv2.addWeighted(color_frame, 0.5, depth_colormap, 0.5, 0)
+
+def find_recordings(paths):
+    """
+    JSONファイルまたはディレクトリから録画データのJSONを列挙する
+    """
+    json_paths = []
+    for path in paths:
+        candidates = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+        for candidate in candidates:
+            with open(candidate) as f:
+                decoded = json.load(f)
+            if isinstance(decoded, dict) and "color_file" in decoded and "depth_file" in decoded:
+                json_paths.append(candidate)
+    return json_paths
+
+def depth_to_uint16(depth_frames: np.ndarray) -> np.ndarray:
+    """
+    Depthをデバイスのz16と同じuint16に変換する(古い録画データはfloat64で保存されている)
+    """
+    if depth_frames.dtype == np.uint16:
+        return depth_frames
+    return np.clip(np.rint(depth_frames), 0, 65535).astype(np.uint16)
+
+# Depthはこのフレーム数ずつ別々に圧縮して保存する(arr_0.npy, arr_1.npy, ...)
+DEPTH_CHUNK_FRAMES = 30
+
+def read_npy_header(stream):
+    """
+    npyのヘッダを読み、(shape, dtype)を返す
+    """
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order:
+        raise ValueError("Not Supported Depth Layout")
+    return shape, dtype
+
+class DepthWriter():
+    """
+    Depthをchunk_framesフレームずつ別々に圧縮したnpz(arr_0, arr_1, ...)に書き込む
+    チャンクごとに展開できるので、読むときは必要なチャンクだけを展開すればよい
+    np.loadで開くと、チャンクごとの配列(フレーム数, 高さ, 幅)が順に入っている
+    """
+    def __init__(self, depth_path: str, chunk_frames: int = DEPTH_CHUNK_FRAMES) -> None:
+        self.archive = zipfile.ZipFile(depth_path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.chunk_frames = chunk_frames
+        self.frames = []
+        self.chunk_count = 0
+
+    def write(self, depth_frame: np.ndarray):
+        self.frames.append(depth_to_uint16(depth_frame))
+        if len(self.frames) >= self.chunk_frames:
+            self._flush()
+
+    def write_frames(self, depth_frames: np.ndarray):
+        for depth_frame in depth_frames:
+            self.write(depth_frame)
+
+    def _flush(self):
+        if len(self.frames) == 0:
+            return
+        with self.archive.open(f"arr_{self.chunk_count}.npy", "w") as f:
+            np.lib.format.write_array(f, np.stack(self.frames))
+        self.frames = []
+        self.chunk_count += 1
+
+    def close(self):
+        self._flush()
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def save_depth(depth_path: str, depth_frames: np.ndarray, chunk_frames: int = DEPTH_CHUNK_FRAMES):
+    """
+    Depth全体をチャンクごとに圧縮して保存する
+    """
+    with DepthWriter(depth_path, chunk_frames) as writer:
+        writer.write_frames(depth_frames)
+
+class DepthReader():
+    """
+    Depthのnpzから必要なフレームだけを読み出す(全体をメモリに載せない)
+    チャンクごとに保存されたDepthは、読むフレームを含むチャンクだけを展開する
+    以前の形式(全フレームで1つの配列)は先頭から順にしか展開できないため、ストリームを開いたまま前方へ読み進め、
+    後ろに戻るときだけ開き直す(migrate_depth.pyでチャンクごとの形式に変換できる)
+    frameで読んだフレームはblock_framesフレーム単位で、最近のcache_blocks個を保持する
+    """
+    READ_BYTES = 1 << 24
+
+    def __init__(self, depth_path: str, block_frames: int = DEPTH_CHUNK_FRAMES, cache_blocks: int = 4) -> None:
+        self.depth_path = depth_path
+        self.cache_blocks = cache_blocks
+        self.cache = OrderedDict()
+        self.archive = None
+        self.stream = None
+        self.stream_member = None
+        self.stream_position = None
+
+        with zipfile.ZipFile(depth_path) as archive:
+            names = [name for name in archive.namelist() if name.startswith("arr_") and name.endswith(".npy")]
+            self.members = sorted(names, key=lambda name: int(name[len("arr_"):-len(".npy")]))
+            if len(self.members) == 0:
+                raise ValueError(f"Not a depth file: {depth_path}")
+            # 最後以外のチャンクはすべて同じフレーム数なので、最初と最後のヘッダだけを読む
+            with archive.open(self.members[0]) as stream:
+                first_shape, self.dtype = read_npy_header(stream)
+            with archive.open(self.members[-1]) as stream:
+                last_shape, _ = read_npy_header(stream)
+        self.chunk_frames: int = first_shape[0]
+        self.total_frames: int = self.chunk_frames * (len(self.members) - 1) + last_shape[0]
+        self.frame_shape = first_shape[1:]
+        self.frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.block_frames = max(1, min(block_frames, self.chunk_frames))
+
+    def _read_member(self, member: int, start: int, end: int) -> bytes:
+        """
+        member番目のチャンクのstart~endフレーム(チャンクの先頭から)を読む
+        """
+        if self.archive is None:
+            self.archive = zipfile.ZipFile(self.depth_path)
+        if self.stream is None or self.stream_member != member or self.stream_position > start:
+            if self.stream is not None:
+                self.stream.close()
+            self.stream = self.archive.open(self.members[member])
+            read_npy_header(self.stream)
+            self.stream_member = member
+            self.stream_position = 0
+        # 圧縮されたチャンクはシークできないので、前にあるフレームは展開して読み捨てる
+        skip = (start - self.stream_position) * self.frame_bytes
+        while skip > 0:
+            skipped = len(self.stream.read(min(skip, self.READ_BYTES)))
+            if skipped == 0:
+                break
+            skip -= skipped
+        buf = self.stream.read((end - start) * self.frame_bytes)
+        self.stream_position = end
+        return buf
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        """
+        start~endフレームのDepthをuint16で返す(キャッシュは使わない)
+        """
+        end = min(end, self.total_frames)
+        parts = []
+        frame = start
+        while frame < end:
+            member = frame // self.chunk_frames
+            member_start = member * self.chunk_frames
+            member_end = min(end, member_start + self.chunk_frames)
+            parts.append(self._read_member(member, frame - member_start, member_end - member_start))
+            frame = member_end
+        depths = np.frombuffer(b"".join(parts), dtype=self.dtype).reshape((-1,) + self.frame_shape)
+        return depth_to_uint16(depths)
+
+    def frame(self, index: int) -> np.ndarray:
+        """
+        indexフレーム目のDepthを返す。同じブロックのフレームはキャッシュから返す
+        """
+        if index < 0 or index >= self.total_frames:
+            raise IndexError(f"frame index out of range: {index}")
+        block = index // self.block_frames
+        if block in self.cache:
+            self.cache.move_to_end(block)
+        else:
+            block_start = block * self.block_frames
+            self.cache[block] = self.read(block_start, block_start + self.block_frames)
+            if len(self.cache) > self.cache_blocks:
+                self.cache.popitem(last=False)
+        return self.cache[block][index % self.block_frames]
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+def iter_depth_chunks(depth_path: str, chunk_frames: int = DEPTH_CHUNK_FRAMES, start: int = 0, end: int = None):
+    """
+    Depthのnpzのstart~endフレームをchunk_framesフレームずつuint16で読み出す(全体をメモリに載せない)
+    """
+    reader = DepthReader(depth_path)
+    end = reader.total_frames if end is None else min(end, reader.total_frames)
+    try:
+        for chunk_start in range(start, end, chunk_frames):
+            yield reader.read(chunk_start, min(chunk_start + chunk_frames, end))
+    finally:
+        reader.close()
@@ -0,0 +1,139 @@
+import argparse
+import time
+import json
+import os
+from collections import deque
+from multiprocessing import Pool
+import cv2
+import numpy as np
+
+from common import RecorderConfig, depth_to_uint16, find_recordings, iter_depth_chunks
+
+# 完了したテイクに置く目印のファイル
+DONE_MARKER = ".done"
+# TUM形式のDepth PNGの単位(1mあたりの値)
+TUM_DEPTH_FACTOR = 5000
+# depth_scaleが記録されていない古い録画データに使う値(D400シリーズの既定値)
+DEFAULT_DEPTH_SCALE = 0.001
+
+def write_png(path: str, image: np.ndarray):
+    """
+    PNGで保存する。中断しても壊れたファイルが残らないよう一時ファイルから置き換える
+    """
+    ret, encoded = cv2.imencode(".png", image)
+    if not ret:
+        raise IOError(f"Failed to encode: {path}")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmp_path, path)
+
+def to_tum_depth(depth_image: np.ndarray, depth_scale: float) -> np.ndarray:
+    """
+    デバイスのDepth単位(1単位 = depth_scale[m])をTUM形式の単位(1m = 5000)に変換する
+    uint16で表せない距離(約13.1m以上)は無効(0)にする
+    """
+    depth = depth_image.astype(np.float32) * (depth_scale * TUM_DEPTH_FACTOR)
+    depth[depth > 65535] = 0
+    return np.rint(depth).astype(np.uint16)
+
+def write_frame(task):
+    rgb_path, depth_path, color_image, depth_image, depth_scale = task
+    write_png(rgb_path, color_image)
+    write_png(depth_path, to_tum_depth(depth_to_uint16(depth_image), depth_scale))
+
+def write_lists(take_dir: str, stamps):
+    with open(os.path.join(take_dir, "rgb.txt"), "w") as f:
+        f.write("# color images\n# timestamp filename\n")
+        for stamp in stamps:
+            f.write(f"{stamp} rgb/{stamp}.png\n")
+    with open(os.path.join(take_dir, "depth.txt"), "w") as f:
+        f.write("# depth maps\n# timestamp filename\n")
+        for stamp in stamps:
+            f.write(f"{stamp} depth/{stamp}.png\n")
+    with open(os.path.join(take_dir, "associations.txt"), "w") as f:
+        for stamp in stamps:
+            f.write(f"{stamp} rgb/{stamp}.png {stamp} depth/{stamp}.png\n")
+
+def write_intrinsics(take_dir: str, config: RecorderConfig):
+    intrinsics = config.intrinsics_color
+    with open(os.path.join(take_dir, "calibration.txt"), "w") as f:
+        f.write(f"{intrinsics['fx']} {intrinsics['fy']} {intrinsics['ppx']} {intrinsics['ppy']}\n")
+    with open(os.path.join(take_dir, "intrinsics.json"), "w") as f:
+        f.write(json.dumps({
+            "width": config.width,
+            "height": config.height,
+            "frequency": config.frequency,
+            "depth_scale": config.depth_scale,
+            "depth_factor": TUM_DEPTH_FACTOR,
+            "intrinsics_color": config.intrinsics_color,
+            "intrinsics_depth": config.intrinsics_depth
+        }, sort_keys=True, indent=2))
+
+def export_recording(json_path: str, out_dir: str, pool: Pool, max_inflight: int):
+    """
+    録画データをTUM形式(フレームごとのPNG, タイムスタンプ一覧, 内部パラメータ)に書き出す
+    書き出し済みのフレームは飛ばすので、中断しても続きから再開できる
+    """
+    export_start = time.time()
+    dir = os.path.split(os.path.abspath(json_path))[0]
+    with open(json_path) as f:
+        config = RecorderConfig.fromJson(json.load(f))
+
+    take_name = os.path.splitext(os.path.basename(json_path))[0]
+    take_dir = os.path.join(out_dir, take_name)
+    if os.path.exists(os.path.join(take_dir, DONE_MARKER)):
+        print(f"skip: {take_name}")
+        return
+    depth_scale = config.depth_scale
+    if depth_scale is None:
+        print(f"depth_scale is not recorded, assume {DEFAULT_DEPTH_SCALE}: {take_name}")
+        depth_scale = DEFAULT_DEPTH_SCALE
+    os.makedirs(os.path.join(take_dir, "rgb"), exist_ok=True)
+    os.makedirs(os.path.join(take_dir, "depth"), exist_ok=True)
+
+    stamps = []
+    pending = deque()
+    written = 0
+    video = cv2.VideoCapture(os.path.join(dir, config.color_file))
+    try:
+        frame_count = 0
+        for depth_chunk in iter_depth_chunks(os.path.join(dir, config.depth_file)):
+            for depth_image in depth_chunk:
+                ret, color_image = video.read()
+                if not ret:
+                    break
+                stamp = f"{frame_count / config.frequency:.6f}"
+                stamps.append(stamp)
+                frame_count += 1
+                rgb_path = os.path.join(take_dir, "rgb", f"{stamp}.png")
+                depth_path = os.path.join(take_dir, "depth", f"{stamp}.png")
+                if os.path.exists(rgb_path) and os.path.exists(depth_path):
+                    continue
+                # 書き出し待ちのフレームを一定数に抑えてメモリ使用量を制限する
+                if len(pending) >= max_inflight:
+                    pending.popleft().get()
+                pending.append(pool.apply_async(write_frame, ((rgb_path, depth_path, color_image, depth_image, depth_scale),)))
+                written += 1
+        while pending:
+            pending.popleft().get()
+    finally:
+        video.release()
+
+    write_lists(take_dir, stamps)
+    write_intrinsics(take_dir, config)
+    with open(os.path.join(take_dir, DONE_MARKER), "w") as f:
+        f.write(f"{len(stamps)}\n")
+    print(f"exported: {take_name} {written}/{len(stamps)} frames {time.time() - export_start:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="+", help="configuration file path or directory")
+    parser.add_argument("-o", "--out", default="tum", help="out directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args()
+
+    json_paths = find_recordings(args.path)
+    with Pool(args.jobs) as pool:
+        for json_path in json_paths:
+            export_recording(json_path, args.out, pool, args.jobs * 4)
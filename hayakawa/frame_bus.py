@@ -0,0 +1,252 @@
+import argparse
+import os
+import time
+from multiprocessing import shared_memory, resource_tracker
+import cv2
+import numpy as np
+
+from common import colorize_depth
+
+# 共有メモリのレイアウト
+#   ヘッダ: int64 x 8 (MAGIC, VERSION, 幅, 高さ, スロット数, 最新の通し番号, 予備, 予備)
+#   スロット情報: SLOT_DTYPE x スロット数
+#   Color: uint8 (スロット数, 高さ, 幅, 3)
+#   Depth: uint16 (スロット数, 高さ, 幅)
+MAGIC = 0x5253425553  # "RSBUS"
+VERSION = 1
+HEADER_SIZE = 8
+H_MAGIC, H_VERSION, H_WIDTH, H_HEIGHT, H_SLOTS, H_LATEST = range(6)
+SLOT_DTYPE = np.dtype([
+    ("seq", np.int64),
+    ("frame_number", np.int64),
+    ("host_time", np.float64),
+    ("device_time", np.float64),
+])
+DEFAULT_SLOTS = 8
+
+def _layout(width: int, height: int, slots: int):
+    """
+    各領域の(オフセット, サイズ)と全体のサイズを返す
+    """
+    header_bytes = HEADER_SIZE * 8
+    slot_bytes = SLOT_DTYPE.itemsize * slots
+    color_bytes = slots * height * width * 3
+    depth_bytes = slots * height * width * 2
+    slot_offset = header_bytes
+    color_offset = slot_offset + slot_bytes
+    depth_offset = color_offset + color_bytes
+    return slot_offset, color_offset, depth_offset, depth_offset + depth_bytes
+
+class BusFrame():
+    """
+    共有メモリから読み出したフレーム
+    color/depthは共有メモリを直接参照しているため、使い終わるまでに上書きされていないかFrameBusSubscriber.is_validで確認する
+    """
+    def __init__(self, seq: int, frame_number: int, host_time: float, device_time: float, color: np.ndarray, depth: np.ndarray) -> None:
+        self.seq: int = seq
+        self.frame_number: int = frame_number
+        self.host_time: float = host_time
+        self.device_time: float = device_time
+        self.color: np.ndarray = color
+        self.depth: np.ndarray = depth
+
+class _FrameBus():
+    def _map(self, width: int, height: int, slots: int):
+        slot_offset, color_offset, depth_offset, _ = _layout(width, height, slots)
+        buf = self.shm.buf
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=buf)
+        self.slot_info = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=buf, offset=slot_offset)
+        self.colors = np.ndarray((slots, height, width, 3), dtype=np.uint8, buffer=buf, offset=color_offset)
+        self.depths = np.ndarray((slots, height, width), dtype=np.uint16, buffer=buf, offset=depth_offset)
+        self.width = width
+        self.height = height
+        self.slots = slots
+
+    def _unmap(self):
+        # 共有メモリを参照している配列を先に解放しないとcloseできない
+        self.header = None
+        self.slot_info = None
+        self.colors = None
+        self.depths = None
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    既存の共有メモリを、終了時に削除されないように開く
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    if os.name != "posix":
+        # Windowsではresource_trackerを使わない
+        return shared_memory.SharedMemory(name=name)
+    # Python 3.12以前のPOSIXでは開いただけでresource_trackerに登録され、購読側の終了時に削除されてしまう。
+    # 後からunregisterすると、配信側と同じresource_trackerを使う子プロセス(fork/spawn)では
+    # 配信側の登録まで消してしまうため、開く間だけ登録を止める
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None if rtype == "shared_memory" else register(name, rtype)
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+class FrameBusPublisher(_FrameBus):
+    """
+    レコーダのフレームを共有メモリのリングバッファに書き込む
+    """
+    def __init__(self, name: str, width: int, height: int, slots: int = DEFAULT_SLOTS) -> None:
+        size = _layout(width, height, slots)[3]
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._map(width, height, slots)
+        self.slot_info[:] = 0
+        self.header[:] = 0
+        self.header[H_WIDTH] = width
+        self.header[H_HEIGHT] = height
+        self.header[H_SLOTS] = slots
+        self.header[H_VERSION] = VERSION
+        # MAGICは最後に書き込み、購読側が初期化途中のヘッダを読まないようにする
+        self.header[H_MAGIC] = MAGIC
+        self.seq = 0
+
+    def publish(self, color_image: np.ndarray, depth_image: np.ndarray, device_time: float = 0.0, frame_number: int = 0):
+        """
+        フレームを次のスロットに書き込む
+        """
+        seq = self.seq + 1
+        slot = seq % self.slots
+        info = self.slot_info[slot]
+        # 書き込み中は通し番号を-1にしておき、購読側が書き換え途中のスロットを使わないようにする
+        info["seq"] = -1
+        self.colors[slot] = color_image
+        self.depths[slot] = depth_image
+        info["frame_number"] = frame_number
+        info["host_time"] = time.time()
+        info["device_time"] = device_time
+        info["seq"] = seq
+        self.header[H_LATEST] = seq
+        self.seq = seq
+
+    def close(self):
+        self._unmap()
+        self.shm.close()
+        self.shm.unlink()
+
+class FrameBusSubscriber(_FrameBus):
+    """
+    FrameBusPublisherが書き込んだ最新のフレームをコピーせずに読み出す
+    """
+    def __init__(self, name: str) -> None:
+        self.shm = _attach_shared_memory(name)
+        header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=self.shm.buf)
+        if header[H_MAGIC] != MAGIC or header[H_VERSION] != VERSION:
+            del header
+            self.shm.close()
+            raise ValueError(f"Not a frame bus: {name}")
+        width, height, slots = int(header[H_WIDTH]), int(header[H_HEIGHT]), int(header[H_SLOTS])
+        del header
+        self._map(width, height, slots)
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self.header[H_LATEST])
+
+    def read_latest(self) -> BusFrame:
+        """
+        最新のフレームを返す。まだ書き込まれていない場合はNoneを返す
+        """
+        while True:
+            seq = self.latest_seq
+            if seq == 0:
+                return None
+            slot = seq % self.slots
+            info = self.slot_info[slot]
+            frame = BusFrame(
+                seq, int(info["frame_number"]), float(info["host_time"]), float(info["device_time"]),
+                self.colors[slot], self.depths[slot]
+            )
+            # 読んでいる間に上書きされた場合は読み直す
+            if int(info["seq"]) == seq:
+                return frame
+
+    def wait_next(self, last_seq: int, timeout: float = 1.0) -> BusFrame:
+        """
+        last_seqより新しいフレームを待って返す。timeout秒経っても来なければNoneを返す
+        """
+        deadline = time.time() + timeout
+        while self.latest_seq <= last_seq:
+            if time.time() > deadline:
+                return None
+            time.sleep(0.001)
+        return self.read_latest()
+
+    def is_valid(self, frame: BusFrame) -> bool:
+        """
+        frameのcolor/depthがまだ上書きされていないかを返す
+        """
+        return int(self.slot_info[frame.seq % self.slots]["seq"]) == frame.seq
+
+    def close(self):
+        self._unmap()
+        self.shm.close()
+
+def publish_synthetic(name: str, width: int, height: int, frequency: int):
+    """
+    合成フレームを配信する(カメラなしで購読側を確認する用途)
+    """
+    from synthetic import SyntheticSource
+    source = SyntheticSource(width, height, frequency)
+    publisher = FrameBusPublisher(name, width, height)
+    source.start()
+    print(f"publishing: {name} {width}x{height} {frequency}fps")
+    try:
+        while True:
+            color_image, depth_image, timestamp, frame_number = source.read()
+            publisher.publish(color_image, depth_image, timestamp, frame_number)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.stop()
+        publisher.close()
+
+def watch_bus(name: str):
+    """
+    共有メモリの最新フレームを表示する
+    """
+    subscriber = FrameBusSubscriber(name)
+    last_seq = 0
+    try:
+        while True:
+            frame = subscriber.wait_next(last_seq)
+            if frame is None:
+                print("no frame")
+                continue
+            dropped = frame.seq - last_seq - 1 if last_seq > 0 else 0
+            last_seq = frame.seq
+            image = np.vstack((frame.color, colorize_depth(frame.depth)))
+            latency = (time.time() - frame.host_time) * 1000
+            image = cv2.putText(
+                image, f"#{frame.seq} skip:{dropped} {latency:.1f}ms",(10,50),
+                cv2.FONT_HERSHEY_PLAIN, 2, (0,0,200), 3
+            )
+            cv2.imshow("Frame Bus", image)
+            del frame
+            k = cv2.waitKey(1)
+            if k & 0xff == 27:
+                cv2.destroyAllWindows()
+                break
+    finally:
+        subscriber.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", help="shared memory name")
+    parser.add_argument("--synthetic", action="store_true", help="publish synthetic frames instead of watching")
+    parser.add_argument("-w", "--width", type=int, default=640, help="horizontal resolution (synthetic)")
+    parser.add_argument("--height", type=int, default=360, help="vertical resolution (synthetic)")
+    parser.add_argument("-f", "--freq", type=int, default=30, help="camera frequency (synthetic)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        publish_synthetic(args.name, args.width, args.height, args.freq)
+    else:
+        watch_bus(args.name)
@@ -0,0 +1,58 @@
+import argparse
+import time
+import json
+import os
+import numpy as np
+
+from common import DEPTH_CHUNK_FRAMES, DepthReader, DepthWriter, RecorderConfig, find_recordings
+
+def migrate_depth_file(depth_path: str, chunk_frames: int) -> bool:
+    """
+    以前の形式(float64、または全フレームで1つの配列)で保存されたDepthのnpzを、
+    uint16でchunk_framesフレームずつ圧縮した形式に変換して置き換える
+    全体をメモリに載せないよう、チャンクごとに読み書きする
+    変換した場合はTrueを返す
+    """
+    reader = DepthReader(depth_path)
+    try:
+        if reader.dtype == np.uint16 and (len(reader.members) > 1 or reader.total_frames <= chunk_frames):
+            return False
+        tmp_path = depth_path + ".tmp"
+        with DepthWriter(tmp_path, chunk_frames) as writer:
+            for chunk_start in range(0, reader.total_frames, chunk_frames):
+                writer.write_frames(reader.read(chunk_start, chunk_start + chunk_frames))
+    finally:
+        reader.close()
+    os.replace(tmp_path, depth_path)
+    return True
+
+def migrate_recording(json_path: str, depth_scale: float, chunk_frames: int):
+    """
+    録画データのDepthを変換し、JSONにdepth_scaleを追記する
+    """
+    migrate_start = time.time()
+    dir = os.path.split(os.path.abspath(json_path))[0]
+    with open(json_path) as f:
+        config = RecorderConfig.fromJson(json.load(f))
+
+    migrated = migrate_depth_file(os.path.join(dir, config.depth_file), chunk_frames)
+
+    if config.depth_scale is None and depth_scale is not None:
+        config.depth_scale = depth_scale
+        with open(json_path, "w") as f:
+            f.write(config.toJson())
+
+    if not migrated:
+        print(f"skip: {json_path}")
+    else:
+        print(f"migrated: {config.depth_file} {time.time() - migrate_start:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="+", help="configuration file path or directory")
+    parser.add_argument("-s", "--depth-scale", type=float, default=None, help="depth scale (meters per unit) to record when missing")
+    parser.add_argument("-c", "--chunk", type=int, default=DEPTH_CHUNK_FRAMES, help="frames per chunk")
+    args = parser.parse_args()
+
+    for json_path in find_recordings(args.path):
+        migrate_recording(json_path, args.depth_scale, args.chunk)
@@ -0,0 +1,100 @@
+import argparse
+import datetime
+import json
+import os
+import socket
+
+from common import DisplayMethod, RecorderConfig
+from record import RealsenseSource, probe_profile
+from synthetic import SyntheticSource
+
+# 計測結果のキャッシュ(デバイスのシリアル番号、ホスト名、表示方法ごと)
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".realsense_recorder", "probe.json")
+
+def cache_key(serial: str, display: DisplayMethod) -> str:
+    # プレビューの合成にかかる時間が表示方法で変わるため、表示方法ごとに計測する
+    return f"{serial}@{socket.gethostname()}/{display.name.lower()}"
+
+def load_cache() -> dict:
+    if not os.path.exists(CACHE_PATH):
+        return {}
+    with open(CACHE_PATH) as f:
+        return json.load(f)
+
+def save_cache(cache: dict):
+    cache_dir = os.path.dirname(CACHE_PATH)
+    if os.path.exists(cache_dir) is False:
+        os.makedirs(cache_dir)
+    tmp_path = CACHE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(cache, sort_keys=True, indent=2))
+    os.replace(tmp_path, CACHE_PATH)
+
+def probe_device(synthetic: bool, probe_sec: float, display: DisplayMethod, show: bool = True):
+    """
+    デバイスが対応している解像度/fpsをすべて計測し、(シリアル番号, 計測結果の一覧)を返す
+    """
+    source_class = SyntheticSource if synthetic else RealsenseSource
+    serial, profiles = source_class.query_profiles()
+    results = []
+    for width, height, frequency in profiles:
+        config = RecorderConfig(width, height, probe_sec, frequency, display)
+        # 複数のデバイスが接続されていても、プロファイルを問い合わせたデバイスで計測する
+        source = SyntheticSource(width, height, frequency) if synthetic else RealsenseSource(width, height, frequency, serial)
+        try:
+            result = probe_profile(source, config, show)
+        except RuntimeError as e:
+            print(f"failed: {width}x{height} {frequency}fps {e}")
+            continue
+        print(f"{width}x{height} {frequency}fps: {result['fps']:.1f}fps drop {result['drop_rate'] * 100:.1f}%")
+        results.append(result)
+    return serial, results
+
+def get_probe_results(synthetic: bool, probe_sec: float, display: DisplayMethod, reprobe: bool = False, show: bool = True):
+    """
+    (シリアル番号, 計測結果の一覧)を返す。キャッシュがない場合やreprobeの場合は計測する
+    """
+    source_class = SyntheticSource if synthetic else RealsenseSource
+    serial, _ = source_class.query_profiles()
+    key = cache_key(serial, display)
+    cache = load_cache()
+    if not reprobe and key in cache:
+        return serial, cache[key]["results"]
+
+    serial, results = probe_device(synthetic, probe_sec, display, show)
+    cache[key] = {
+        "time": datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S'),
+        "probe_sec": probe_sec,
+        "results": results
+    }
+    save_cache(cache)
+    return serial, results
+
+def select_profile(results, max_drop_rate: float):
+    """
+    ドロップ率がmax_drop_rate以下、かつ実際のfpsが指定したfpsの(1 - max_drop_rate)倍以上の中で
+    最も解像度(同じならfps)が高い(幅, 高さ, fps)を返す
+    """
+    candidates = [
+        result for result in results
+        if result["frames"] > 0 and result["drop_rate"] <= max_drop_rate
+        and result["fps"] >= result["frequency"] * (1 - max_drop_rate)
+    ]
+    if len(candidates) == 0:
+        raise ValueError(f"No profile meets drop rate {max_drop_rate * 100:.1f}%")
+    best = max(candidates, key=lambda result: (result["width"] * result["height"], result["frequency"]))
+    return best["width"], best["height"], best["frequency"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", "--time", type=float, default=3.0, help="probe time per profile in second")
+    parser.add_argument("-m", "--max-drop", type=float, default=0.01, help="acceptable drop rate")
+    parser.add_argument("-d", "--display", default="stack", choices={"stack", "blend"}, help="display method")
+    parser.add_argument("--synthetic", action="store_true", help="probe synthetic frames instead of the camera")
+    parser.add_argument("--no-window", action="store_true", help="do not show preview while probing")
+    args = parser.parse_args()
+    display = DisplayMethod.STACK if args.display == "stack" else DisplayMethod.BLEND
+
+    serial, results = get_probe_results(args.synthetic, args.time, display, reprobe=True, show=not args.no_window)
+    width, height, frequency = select_profile(results, args.max_drop)
+    print(f"selected: {serial} {width}x{height} {frequency}fps")
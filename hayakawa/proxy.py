@@ -0,0 +1,149 @@
+import argparse
+import time
+import json
+import os
+import cv2
+import numpy as np
+
+from common import DepthReader, DepthWriter, RecorderConfig, iter_depth_chunks
+
+# プロキシは縦横1/2(画素数1/4)で保存する
+PROXY_SCALE = 2
+
+def proxy_size(config: RecorderConfig):
+    """
+    プロキシの解像度(幅, 高さ)を返す
+    """
+    return config.width // PROXY_SCALE, config.height // PROXY_SCALE
+
+def downsample_color(color_frame: np.ndarray, size) -> np.ndarray:
+    return cv2.resize(color_frame, size, interpolation=cv2.INTER_AREA)
+
+def downsample_depth(depth_frame: np.ndarray, size) -> np.ndarray:
+    # Depthは補間すると境界で存在しない距離が生まれるので最近傍で間引く
+    return cv2.resize(depth_frame, size, interpolation=cv2.INTER_NEAREST)
+
+def upsample(frame: np.ndarray, size) -> np.ndarray:
+    """
+    プロキシのフレームを表示用に元の解像度へ拡大する
+    """
+    return cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+
+def open_proxy_writer(out_dir: str, config: RecorderConfig):
+    """
+    プロキシ用のVideoWriterを開き、configにプロキシのファイル名を設定する
+    """
+    config.proxy_color_file = f"{config.time_str}-proxy-rgb.avi"
+    config.proxy_depth_file = f"{config.time_str}-proxy-depth.npz"
+    color_path = str(os.path.join(out_dir, config.proxy_color_file))
+    # MJPGは全フレームがイントラなので任意のフレームに即座にシークできる
+    fmt = cv2.VideoWriter_fourcc(*"MJPG")
+    return cv2.VideoWriter(color_path, fmt, config.frequency, proxy_size(config))
+
+def open_proxy_depth_writer(out_dir: str, config: RecorderConfig) -> DepthWriter:
+    """
+    プロキシのDepthを書き込むDepthWriterを開く
+    スクラブ中は1フレームずつ飛び飛びに読むため、フレームごとに圧縮する(arr_0, arr_1, ...)
+    """
+    return DepthWriter(str(os.path.join(out_dir, config.proxy_depth_file)), chunk_frames=1)
+
+def save_proxy(recorded_colors: np.ndarray, recorded_depths: np.ndarray, out_dir: str, config: RecorderConfig):
+    """
+    録画したデータから低解像度のプロキシ(RGB, Depth)を保存する
+    """
+    size = proxy_size(config)
+    writer = open_proxy_writer(out_dir, config)
+    depth_writer = open_proxy_depth_writer(out_dir, config)
+    for i in range(recorded_colors.shape[0]):
+        writer.write(downsample_color(recorded_colors[i,:,:,:], size))
+        depth_writer.write(downsample_depth(recorded_depths[i,:,:], size))
+    writer.release()
+    depth_writer.close()
+
+class Proxy():
+    """
+    プロキシを必要なフレームだけ読み込む
+    """
+    def __init__(self, color_path: str, depth_path: str, start: int = 0, end: int = None) -> None:
+        self.color_path = color_path
+        self.depth_reader = DepthReader(depth_path, block_frames=1)
+        total_frames = self.depth_reader.total_frames
+        self.start = start
+        self.end = total_frames if end is None else min(end, total_frames)
+        self._video = None
+        self._next_frame = None
+
+    def __len__(self) -> int:
+        return max(0, self.end - self.start)
+
+    def __getitem__(self, index: int):
+        """
+        indexフレーム目の(Color, Depth)を返す
+        """
+        frame = self.start + index
+        if self._video is None:
+            self._video = cv2.VideoCapture(self.color_path)
+            self._next_frame = 0
+        if self._next_frame != frame:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ret, color_frame = self._video.read()
+        if not ret:
+            raise IOError(f"Failed to read frame {frame}: {self.color_path}")
+        self._next_frame = frame + 1
+        return color_frame, self.depth_reader.frame(frame)
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+        self.depth_reader.close()
+
+def load_proxy(dir: str, config: RecorderConfig, start: int = 0, end: int = None):
+    """
+    プロキシを開く。存在しない場合はNoneを返す
+    """
+    if config.proxy_color_file is None or config.proxy_depth_file is None:
+        return None
+    color_path = os.path.join(dir, config.proxy_color_file)
+    depth_path = os.path.join(dir, config.proxy_depth_file)
+    if not os.path.exists(color_path) or not os.path.exists(depth_path):
+        return None
+    return Proxy(color_path, depth_path, start, end)
+
+def make_proxy(json_path: str):
+    """
+    既存の録画データからプロキシを作成し、JSONにプロキシのファイル名を追記する
+    """
+    make_start = time.time()
+    dir = os.path.split(os.path.abspath(json_path))[0]
+    with open(json_path) as f:
+        config = RecorderConfig.fromJson(json.load(f))
+
+    size = proxy_size(config)
+    writer = open_proxy_writer(dir, config)
+    depth_writer = open_proxy_depth_writer(dir, config)
+    video = cv2.VideoCapture(os.path.join(dir, config.color_file))
+    try:
+        for depth_chunk in iter_depth_chunks(os.path.join(dir, config.depth_file)):
+            for depth_frame in depth_chunk:
+                ret, color_frame = video.read()
+                if not ret:
+                    break
+                writer.write(downsample_color(color_frame, size))
+                depth_writer.write(downsample_depth(depth_frame, size))
+    finally:
+        video.release()
+        writer.release()
+        depth_writer.close()
+
+    with open(json_path, "w") as f:
+        f.write(config.toJson())
+    print(f"proxy saved: {time.time() - make_start}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("json", nargs="+", help="configuration file path")
+    args = parser.parse_args()
+
+    for json_path in args.json:
+        make_proxy(json_path)
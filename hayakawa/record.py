@@ -5,17 +5,26 @@ import time
 import datetime
 import argparse
 import os
-import pyrealsense2 as rs
 import numpy as np
 import cv2
 
-from common import DisplayMethod, RecorderConfig
+from common import DisplayMethod, RecorderConfig, colorize_depth, compose_view, save_depth
+from proxy import save_proxy
+from synthetic import SyntheticSource
+
+# プレビューの大きさ
+PREVIEW_SIZE = (640, 360)
+TOP_BAR_SIZE = (56, 640, 3)
 
 class RecorderState(Enum):
     WAITING = auto()
     RECORDING = auto()
 
 class SaveThread():
+    """
+    録画中のフレームを受け取ってバッファに貯め、終了後に保存する
+    out_dirがNoneの場合は保存しない(計測用)
+    """
     def __init__(self, out_dir: str, config: RecorderConfig) -> None:
         self.thread = Thread(target=self.run)
         self.finished = False
@@ -24,7 +33,7 @@ class SaveThread():
         self.out_dir = out_dir
         self.max_frame = int(config.frequency * config.time_sec)
         self.recorded_colors = np.zeros((self.max_frame, config.height, config.width, 3), dtype=np.uint8)
-        self.recorded_depths = np.zeros((self.max_frame, config.height, config.width), dtype=np.float)
+        self.recorded_depths = np.zeros((self.max_frame, config.height, config.width), dtype=np.uint16)
 
     def start(self):
         self.thread.start()
@@ -47,11 +56,12 @@ class SaveThread():
             self.recorded_depths[frame_counter,:,:] = depth_image
             frame_counter += 1
 
-        self.save_recorded_data(self.recorded_colors, self.recorded_depths, self.out_dir, self.config)
+        if self.out_dir is not None:
+            self.save_recorded_data(self.recorded_colors, self.recorded_depths, self.out_dir, self.config)
 
     def save_recorded_data(self, recorded_colors: np.ndarray, recorded_depths: np.ndarray, out_dir: str, config: RecorderConfig):
         """
-        録画したデータをRGB, Depth, JSONの3つに保存する
+        録画したデータをRGB, Depth, JSONの3つとプロキシに保存する
         """
         save_start = time.time()
         if os.path.exists(out_dir) is False:
@@ -60,16 +70,16 @@ class SaveThread():
         config.depth_file = f"{config.time_str}-depth.npz"
         config.color_file = f"{config.time_str}-rgb.avi"
 
+        # プロキシの保存(JSONにファイル名を書き込むため先に保存する)
+        save_proxy(recorded_colors, recorded_depths, out_dir, config)
+
         # JSONの保存
         with open(str(os.path.join(out_dir, f"{config.time_str}.json")), "w") as f:
             f.write(config.toJson())
 
         # Depthの保存
         depth_path = str(os.path.join(out_dir, config.depth_file))
-        np.savez_compressed(
-            depth_path,
-            recorded_depths
-        )
+        save_depth(depth_path, recorded_depths)
 
         # RGBの保存
         color_path = str(os.path.join(out_dir, config.color_file))
@@ -80,31 +90,127 @@ class SaveThread():
         writer.release()
         print(f"saved: {time.time() - save_start}s")
 
-def start_recorder(recorder_config: RecorderConfig, out_dir: str):
+class RealsenseSource():
+    """
+    RealsenseからColor/Depthのフレームを取得する
+    serialを指定するとそのデバイスを使う(複数接続している場合に計測したデバイスと揃える)
+    """
+    def __init__(self, width: int, height: int, frequency: int, serial: str = None) -> None:
+        self.width = width
+        self.height = height
+        self.frequency = frequency
+        self.serial = serial
+        self.pipeline = None
+        self.align = None
+        self.depth_scale = None
+
+    def start(self):
+        """
+        ストリーミングを開始し、(Colorの内部パラメータ, Depthの内部パラメータ)を返す
+        """
+        # 合成ソース(--synthetic)だけを使う場合にlibrealsenseを必要としないよう、使うときに読み込む
+        import pyrealsense2 as rs
+
+        # ストリーム(Depth/Color)の設定
+        config = rs.config()
+        if self.serial is not None:
+            config.enable_device(self.serial)
+        config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, self.frequency)
+        config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.frequency)
+
+        # ストリーミング開始
+        self.pipeline = rs.pipeline()
+        profile = self.pipeline.start(config)
+        depth_intrinsics = rs.video_stream_profile(profile.get_stream(rs.stream.depth)).get_intrinsics()
+        color_intrinsics = rs.video_stream_profile(profile.get_stream(rs.stream.color)).get_intrinsics()
+        self.depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+
+        # Alignオブジェクト生成
+        align_to = rs.stream.color
+        self.align = rs.align(align_to)
+        return color_intrinsics, depth_intrinsics
+
+    def read(self):
+        """
+        次のフレームを待って(Color画像, Depth画像, タイムスタンプ[ms], フレーム番号)を返す
+        フレームが欠けていた場合はNoneを返す
+        """
+        frames = self.pipeline.wait_for_frames()
+        frames = self.align.process(frames)
+
+        color_frame = frames.get_color_frame()
+        depth_frame = frames.get_depth_frame()
+        if not depth_frame or not color_frame:
+            return None
+
+        color_image = np.asanyarray(color_frame.get_data())
+        depth_image = np.asanyarray(depth_frame.get_data())
+        return color_image, depth_image, color_frame.get_timestamp(), color_frame.get_frame_number()
+
+    def stop(self):
+        self.pipeline.stop()
+
+    @staticmethod
+    def query_profiles():
+        """
+        接続されているデバイスのシリアル番号と、Color(bgr8)とDepth(z16)の両方で使える(幅, 高さ, fps)の一覧を返す
+        """
+        import pyrealsense2 as rs
+        devices = rs.context().query_devices()
+        if len(devices) == 0:
+            raise RuntimeError("No device connected")
+        device = devices[0]
+        serial = device.get_info(rs.camera_info.serial_number)
+        color_profiles = set()
+        depth_profiles = set()
+        for sensor in device.query_sensors():
+            for profile in sensor.get_stream_profiles():
+                if not profile.is_video_stream_profile():
+                    continue
+                video_profile = profile.as_video_stream_profile()
+                key = (video_profile.width(), video_profile.height(), profile.fps())
+                if profile.stream_type() == rs.stream.color and profile.format() == rs.format.bgr8:
+                    color_profiles.add(key)
+                elif profile.stream_type() == rs.stream.depth and profile.format() == rs.format.z16:
+                    depth_profiles.add(key)
+        return serial, sorted(color_profiles & depth_profiles)
+
+def render_preview(color_image: np.ndarray, depth_image: np.ndarray, display: DisplayMethod, text: str) -> np.ndarray:
+    """
+    レコーダのプレビュー画像(上部に情報を表示したバー + 縮小したColor/Depth)を作る
+    """
+    top_bar = np.zeros(TOP_BAR_SIZE, dtype=np.uint8)
+    top_bar = cv2.putText(
+        top_bar, text,(10,50),
+        cv2.FONT_HERSHEY_PLAIN, 2, (0,0,200), 3
+    )
+
+    color_image = cv2.resize(color_image, PREVIEW_SIZE, interpolation=cv2.INTER_NEAREST)
+    depth_image = cv2.resize(depth_image, PREVIEW_SIZE, interpolation=cv2.INTER_NEAREST)
+
+    if display == DisplayMethod.STACK:
+        return np.vstack((top_bar, color_image, colorize_depth(depth_image)))
+    return np.vstack((top_bar, compose_view(color_image, depth_image, display)))
+
+def start_recorder(recorder_config: RecorderConfig, out_dir: str, source = None, bus_name: str = None):
     """
     レコーダを表示する
+    bus_nameを指定すると、取得したフレームを共有メモリに配信する
     """
     width = recorder_config.width
     height = recorder_config.height
     frequency = recorder_config.frequency
     time_sec = recorder_config.time_sec
-    # ストリーム(Depth/Color)の設定
-    config = rs.config()
-    config.enable_stream(rs.stream.color, width, height, rs.format.bgr8, frequency)
-    config.enable_stream(rs.stream.depth, width, height, rs.format.z16, frequency)
+    if source is None:
+        source = RealsenseSource(width, height, frequency)
 
-    # ストリーミング開始
-    pipeline = rs.pipeline()
-    profile = pipeline.start(config)
-    depth_intrinsics = rs.video_stream_profile(profile.get_stream(rs.stream.depth)).get_intrinsics()
-    color_intrinsics = rs.video_stream_profile(profile.get_stream(rs.stream.color)).get_intrinsics()
+    color_intrinsics, depth_intrinsics = source.start()
 
     recorder_config.intrinsics_color = color_intrinsics
     recorder_config.intrinsics_depth = depth_intrinsics
+    recorder_config.depth_scale = source.depth_scale
 
-    # Alignオブジェクト生成
-    align_to = rs.stream.color
-    align = rs.align(align_to)
+    bus = None
 
     recorder_state = RecorderState.WAITING
     frame_counter = 0
@@ -115,39 +221,36 @@ def start_recorder(recorder_config: RecorderConfig, out_dir: str):
 
     time_start = None
 
-    top_bar_size = (56, 640, 3)
-    
     prev_time = time.time()
     actual_fps = 0.0
 
     try:
+        # 名前が使われている場合などに例外になっても、finallyでストリーミングを止める
+        if bus_name is not None:
+            # multiprocessing.shared_memoryはPython 3.8以降にしかないため、使うときだけ読み込む
+            from frame_bus import FrameBusPublisher
+            bus = FrameBusPublisher(bus_name, width, height)
+
         while True:
             frame_counter += 1
             if frame_counter % 30 == 0:
                 actual_fps = 30 / (time.time() - prev_time)
                 prev_time = time.time()
 
-            frames = pipeline.wait_for_frames()
-            frames = align.process(frames)         
-
-            color_frame = frames.get_color_frame()
-            depth_frame = frames.get_depth_frame()
-            if not depth_frame or not color_frame:
+            received = source.read()
+            if received is None:
                 print("********* frame is dropped **********")
                 continue
 
-            color_image = np.asanyarray(color_frame.get_data())
-            depth_image = np.asanyarray(depth_frame.get_data())
+            color_image, depth_image, timestamp, frame_number = received
 
-            depth_colormap = cv2.applyColorMap(
-                cv2.convertScaleAbs(depth_image, alpha=0.08), cv2.COLORMAP_JET
-            )
+            if bus is not None:
+                bus.publish(color_image, depth_image, timestamp, frame_number)
 
-            top_bar = np.zeros(top_bar_size, dtype=np.uint8)
             elapsed_sec = frame_counter / frequency if recorder_state == RecorderState.RECORDING else 0.0
-            top_bar = cv2.putText(
-                top_bar, f"{width}x{height} {actual_fps:.1f}/{frequency}fps {elapsed_sec:.2f}/{time_sec:.2f}s",(10,50),
-                cv2.FONT_HERSHEY_PLAIN, 2, (0,0,200), 3
+            preview = render_preview(
+                color_image, depth_image, recorder_config.display,
+                f"{width}x{height} {actual_fps:.1f}/{frequency}fps {elapsed_sec:.2f}/{time_sec:.2f}s"
             )
 
             if recorder_state == RecorderState.RECORDING:
@@ -157,21 +260,8 @@ def start_recorder(recorder_config: RecorderConfig, out_dir: str):
                     save_thread.data_queue.put("STOP")
                     recorder_state = RecorderState.WAITING
 
-            color_image = cv2.resize(color_image, (640, 360), interpolation=cv2.INTER_NEAREST)
-            depth_image = cv2.resize(depth_image, (640, 360), interpolation=cv2.INTER_NEAREST)
-            depth_colormap = cv2.applyColorMap(
-                cv2.convertScaleAbs(depth_image, alpha=0.08), cv2.COLORMAP_JET
-            )
-
             cv2.namedWindow("Recorder", cv2.WINDOW_AUTOSIZE)
-            if recorder_config.display == DisplayMethod.STACK:
-                cv2.imshow("Recorder", np.vstack((top_bar, color_image, depth_colormap)))
-            else:
-                img_mask = cv2.bitwise_not(cv2.inRange(depth_colormap, np.array([128,0,0]), np.array([128,0,0])))
-                depth_colormap = cv2.bitwise_and(depth_colormap, depth_colormap, mask=img_mask)
-
-                blended = cv2.addWeighted(color_image, 0.5, depth_colormap, 0.5, 0)
-                cv2.imshow("Recorder", np.vstack((top_bar, blended)))
+            cv2.imshow("Recorder", preview)
 
             k = cv2.waitKey(1)
             if k & 0xff == 27:
@@ -187,10 +277,83 @@ def start_recorder(recorder_config: RecorderConfig, out_dir: str):
     except BaseException as e:
         print(e)
     finally:
-        pipeline.stop()
+        source.stop()
+        if bus is not None:
+            bus.close()
         if save_thread is not None:
             save_thread.finish()
 
+def probe_profile(source, recorder_config: RecorderConfig, show: bool = True) -> dict:
+    """
+    録画と同じ処理(Align, プレビュー, 保存用バッファへのコピー)を行いながらrecorder_config.time_sec秒取得し、
+    ドロップしたフレームの割合を計測する
+    ドロップ数は最初のフレームからの経過時間 * fpsで届くはずだったフレーム数との差とする
+    (フレーム番号の欠けだけでなく、自動露出などで実際のfpsが下がった場合や、フレームが届かず打ち切った場合も含まれる)
+    """
+    width = recorder_config.width
+    height = recorder_config.height
+    frequency = recorder_config.frequency
+    source.start()
+
+    # 保存はしないが、バッファへのコピーは録画時と同様に行う
+    save_thread = SaveThread(None, recorder_config)
+    save_thread.start()
+
+    frame_counter = 0
+    time_start = time.time()
+    time_first = None
+    time_last = None
+    try:
+        while frame_counter < save_thread.max_frame:
+            # フレームが届かない場合に備え、録画時間の2倍で打ち切る
+            if time.time() - time_start > recorder_config.time_sec * 2:
+                break
+            received = source.read()
+            if received is None:
+                continue
+
+            time_last = time.time()
+            if time_first is None:
+                time_first = time_last
+            color_image, depth_image, timestamp, frame_number = received
+
+            preview = render_preview(
+                color_image, depth_image, recorder_config.display,
+                f"probe {width}x{height} {frequency}fps"
+            )
+            save_thread.data_queue.put((color_image, depth_image))
+            frame_counter += 1
+
+            if show:
+                cv2.namedWindow("Probe", cv2.WINDOW_AUTOSIZE)
+                cv2.imshow("Probe", preview)
+                cv2.waitKey(1)
+    finally:
+        time_end = time.time()
+        source.stop()
+        save_thread.data_queue.put("STOP")
+        save_thread.thread.join()
+        if show:
+            cv2.destroyAllWindows()
+
+    if time_first is None:
+        # 1フレームも届かなかった場合は計測時間分すべてドロップしたとみなす
+        expected = max(int((time_end - time_start) * frequency), 1)
+        fps = 0.0
+    else:
+        expected = int((time_end - time_first) * frequency) + 1
+        fps = (frame_counter - 1) / (time_last - time_first) if frame_counter > 1 else 0.0
+    dropped = max(expected - frame_counter, 0)
+    return {
+        "width": width,
+        "height": height,
+        "frequency": frequency,
+        "frames": frame_counter,
+        "dropped": dropped,
+        "drop_rate": dropped / max(frame_counter + dropped, 1),
+        "fps": fps
+    }
+
 def resolve_resolution(width, height, frequency):
     """
     Realsenseで使える解像度が限られているため、解決する
@@ -227,6 +390,12 @@ if __name__ == "__main__":
     parser.add_argument("-f", "--freq", type=int, default=30, help="camera frequency")
     parser.add_argument("-o", "--out", default=".", help="out directory")
     parser.add_argument("-d", "--display", default="stack", choices={"stack", "blend"}, help="display method")
+    parser.add_argument("-b", "--bus", default=None, help="publish frames to shared memory with this name")
+    parser.add_argument("--synthetic", action="store_true", help="use synthetic frames instead of the camera")
+    parser.add_argument("-a", "--auto", action="store_true", help="select the highest profile that meets the drop rate (probe results are cached)")
+    parser.add_argument("--max-drop", type=float, default=0.01, help="acceptable drop rate for --auto")
+    parser.add_argument("--probe-time", type=float, default=3.0, help="probe time per profile in second for --auto")
+    parser.add_argument("--reprobe", action="store_true", help="ignore cached probe results for --auto")
     args = parser.parse_args()
     width = args.width
     height = args.height
@@ -236,8 +405,21 @@ if __name__ == "__main__":
     display = DisplayMethod.STACK if args.display == "stack" else DisplayMethod.BLEND
 
     try:
-        width, height, frequency = resolve_resolution(width, height, frequency)
+        if args.auto:
+            # probeはこのモジュールを読み込むため、ここで読み込む
+            from probe import get_probe_results, select_profile
+            serial, results = get_probe_results(args.synthetic, args.probe_time, display, args.reprobe)
+            width, height, frequency = select_profile(results, args.max_drop)
+            print(f"selected: {serial} {width}x{height} {frequency}fps")
+        else:
+            serial = None
+            width, height, frequency = resolve_resolution(width, height, frequency)
         config = RecorderConfig(width, height, record_time_sec, frequency, display)
-        start_recorder(config, out_dir)
+        if args.synthetic:
+            source = SyntheticSource(width, height, frequency)
+        else:
+            # 自動選択した場合は計測したデバイスで録画する
+            source = RealsenseSource(width, height, frequency, serial)
+        start_recorder(config, out_dir, source, args.bus)
     except BaseException as e:
         print(e)
@@ -0,0 +1,245 @@
+import json
+import os
+from collections import deque
+import multiprocessing
+import cv2
+import numpy as np
+
+from common import DEPTH_CHUNK_FRAMES, DepthReader, RecorderConfig, iter_depth_chunks
+from proxy import load_proxy
+
+# 各ワーカープロセスで開いている動画(パス -> (VideoCapture, 次に読むフレーム))とDepth(パス -> DepthReader)
+_worker_videos = {}
+_worker_depths = {}
+
+def _decode_colors(color_path: str, start: int, end: int):
+    """
+    start~endフレームのColorをデコードする(ワーカープロセスで実行する)
+    """
+    video, next_frame = _worker_videos.get(color_path, (None, None))
+    if video is None:
+        video = cv2.VideoCapture(color_path)
+        next_frame = 0
+    if next_frame != start:
+        video.set(cv2.CAP_PROP_POS_FRAMES, start)
+    colors = []
+    for _ in range(start, end):
+        ret, color_frame = video.read()
+        if not ret:
+            break
+        colors.append(color_frame)
+    _worker_videos[color_path] = (video, start + len(colors))
+    if len(colors) == 0:
+        return np.zeros((0, 0, 0, 3), dtype=np.uint8)
+    return np.stack(colors)
+
+def _decode_batch(color_path: str, depth_path: str, start: int, end: int):
+    """
+    start~endフレームの(Color, Depth)をデコードする(ワーカープロセスで実行する)
+    Depthはこの範囲を含むチャンクだけをワーカーで展開し、親プロセスでは展開しない
+    """
+    colors = _decode_colors(color_path, start, end)
+    reader = _worker_depths.get(depth_path)
+    if reader is None:
+        reader = DepthReader(depth_path)
+        _worker_depths[depth_path] = reader
+    depths = reader.read(start, start + colors.shape[0])
+    return colors, depths
+
+def _map_batch(func, color_path: str, depth_path: str, start: int, end: int, first_frame: int):
+    """
+    start~endフレームをデコードしてfuncに渡し、(フレームがあったか, funcの結果)を返す(ワーカープロセスで実行する)
+    funcがNoneを返す場合もあるので、読めるフレームがなかったことは結果とは別に返す
+    """
+    colors, depths = _decode_batch(color_path, depth_path, start, end)
+    if colors.shape[0] == 0:
+        return False, None
+    if func is None:
+        return True, (colors, depths)
+    return True, func(colors, depths, first_frame)
+
+class Recording():
+    """
+    録画データ(JSON, RGB, Depth)を必要になったときに読み込む
+    len, インデックス(Color, Depthの組), スライス, 時間での範囲指定に対応する
+    """
+    def __init__(self, json_path: str, start: int = 0, end: int = None) -> None:
+        self.json_path = json_path
+        self.dir = os.path.split(os.path.abspath(json_path))[0]
+        with open(json_path) as f:
+            self.config: RecorderConfig = RecorderConfig.fromJson(json.load(f))
+        self.color_path = os.path.join(self.dir, self.config.color_file)
+        self.depth_path = os.path.join(self.dir, self.config.depth_file)
+
+        self._depth_reader = DepthReader(self.depth_path, block_frames=8)
+        self.total_frames: int = self._depth_reader.total_frames
+        self.start: int = start
+        self.end: int = self.total_frames if end is None else min(end, self.total_frames)
+
+        self._video = None
+        self._next_frame = None
+        self._pool = None
+        self._pool_workers = None
+
+    @property
+    def frequency(self) -> int:
+        return self.config.frequency
+
+    def __len__(self) -> int:
+        return max(0, self.end - self.start)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, end, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Not Supported Slice Step")
+            return self._view(self.start + start, self.start + max(start, end))
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(f"frame index out of range: {index}")
+        return self.color(index), self.depth(index)
+
+    def _view(self, start: int, end: int):
+        view = Recording.__new__(Recording)
+        view.json_path = self.json_path
+        view.dir = self.dir
+        view.config = self.config
+        view.color_path = self.color_path
+        view.depth_path = self.depth_path
+        view.total_frames = self.total_frames
+        view.start = start
+        view.end = end
+        view._video = None
+        view._next_frame = None
+        view._pool = None
+        view._pool_workers = None
+        view._depth_reader = self._depth_reader
+        return view
+
+    def time_range(self, start_sec: float, end_sec: float = None):
+        """
+        start_sec~end_sec秒(この範囲の先頭からの秒数)を切り出す
+        """
+        start = int(round(start_sec * self.frequency))
+        end = None if end_sec is None else int(round(end_sec * self.frequency))
+        return self[start:end]
+
+    def color(self, index: int) -> np.ndarray:
+        """
+        indexフレーム目のColorを返す。連続して読む場合はシークしない
+        """
+        frame = self.start + index
+        if self._video is None:
+            self._video = cv2.VideoCapture(self.color_path)
+            self._next_frame = 0
+        if self._next_frame != frame:
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        ret, color_frame = self._video.read()
+        if not ret:
+            raise IOError(f"Failed to read frame {frame}: {self.color_path}")
+        self._next_frame = frame + 1
+        return color_frame
+
+    def depth(self, index: int) -> np.ndarray:
+        """
+        indexフレーム目のDepthを返す。前後のフレームとまとめて読み込み、最近読んだ分だけを保持する
+        """
+        return self._depth_reader.frame(self.start + index)
+
+    def proxy(self):
+        """
+        この範囲のプロキシを開く。存在しない場合はNoneを返す
+        """
+        return load_proxy(self.dir, self.config, self.start, self.end)
+
+    def iter_frames(self, chunk_frames: int = 30):
+        """
+        先頭から順に(Color, Depth)を返す。Depthは少しずつ読み込む
+        """
+        video = cv2.VideoCapture(self.color_path)
+        try:
+            if self.start > 0:
+                video.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            for depth_chunk in iter_depth_chunks(self.depth_path, chunk_frames, self.start, self.end):
+                for depth_frame in depth_chunk:
+                    ret, color_frame = video.read()
+                    if not ret:
+                        return
+                    yield color_frame, depth_frame
+        finally:
+            video.release()
+
+    def iter_batches(self, batch_size: int = DEPTH_CHUNK_FRAMES, workers: int = None, prefetch: int = 2):
+        """
+        batch_sizeフレームずつ(Color, Depth)の配列を返す(区切りはファイルの先頭から数えるので、最初のバッチは短くなることがある)
+        ColorとDepthは複数のワーカープロセスでデコードし、workers * prefetchバッチ分を先読みする
+        """
+        for colors, depths in self.map_batches(None, batch_size, workers, prefetch):
+            yield colors, depths
+
+    def map_batches(self, func, batch_size: int = DEPTH_CHUNK_FRAMES, workers: int = None, prefetch: int = 2):
+        """
+        batch_sizeフレームずつデコードした(Color, Depth)の配列と先頭のフレーム番号(この範囲の先頭から)を
+        ワーカープロセスでfunc(colors, depths, first_frame)に渡し、結果を順に返す
+        デコードと処理を同じプロセスで行うため、フレームを親プロセスとやり取りするのは結果の1回だけで済む
+        """
+        workers = os.cpu_count() if workers is None else workers
+        pool = self._get_pool(workers)
+        # バッチの区切りをファイルの先頭からbatch_sizeごとにして、Depthのチャンクの区切りと揃える
+        first_end = (self.start // batch_size + 1) * batch_size
+        starts = iter([self.start] + list(range(first_end, self.end, batch_size)))
+        pending = deque()
+        def submit(start):
+            end = min((start // batch_size + 1) * batch_size, self.end)
+            args = (func, self.color_path, self.depth_path, start, end, start - self.start)
+            pending.append(pool.apply_async(_map_batch, args))
+        try:
+            for start in starts:
+                submit(start)
+                if len(pending) >= workers * prefetch:
+                    break
+            while pending:
+                has_frames, result = pending.popleft().get()
+                if not has_frames:
+                    break
+                start = next(starts, None)
+                if start is not None:
+                    submit(start)
+                yield result
+        finally:
+            if pending:
+                # 途中で抜けた場合、先読み中のバッチが次の呼び出しの前に残らないようワーカーごと止める
+                self._close_pool()
+
+    def _get_pool(self, workers: int):
+        """
+        ワーカープロセスを作る(同じ数なら使い回す)
+        OpenCVやPoolのスレッドを持つ親プロセスをforkしないよう、spawnで起動する
+        """
+        if self._pool is not None and self._pool_workers != workers:
+            self._close_pool()
+        if self._pool is None:
+            self._pool = multiprocessing.get_context("spawn").Pool(workers)
+            self._pool_workers = workers
+        return self._pool
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            self._pool_workers = None
+
+    def close(self):
+        self._close_pool()
+        self._depth_reader.close()
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
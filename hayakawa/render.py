@@ -0,0 +1,98 @@
+import argparse
+import time
+import os
+from functools import partial
+from queue import Queue
+from threading import Thread
+import cv2
+import numpy as np
+
+from common import DEPTH_CHUNK_FRAMES, DisplayMethod, compose_view, find_recordings
+from recording import Recording
+
+def _render_batch(display: DisplayMethod, frame_num: int, frequency: int, colors: np.ndarray, depths: np.ndarray, first_frame: int):
+    """
+    Colorの上にフレーム番号と時刻を描き、表示方法に合わせて合成する(デコードしたワーカープロセスで実行する)
+    """
+    rendered = []
+    for i in range(colors.shape[0]):
+        frame = first_frame + i
+        color_frame = cv2.putText(
+            colors[i].copy(), f"{frame+1}/{frame_num}f {frame / frequency:.2f}s",(10,50),
+            cv2.FONT_HERSHEY_PLAIN, 2, (0,0,200), 3
+        )
+        rendered.append(compose_view(color_frame, depths[i], display))
+    return np.stack(rendered)
+
+class WriteThread():
+    """
+    合成したフレームを別スレッドで動画にエンコードする
+    """
+    def __init__(self, out_path: str, frequency: int, size, max_batches: int) -> None:
+        fmt = cv2.VideoWriter_fourcc(*"mp4v")
+        self.writer = cv2.VideoWriter(out_path, fmt, frequency, size)
+        self.data_queue = Queue(maxsize=max_batches)
+        self.thread = Thread(target=self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while True:
+            received = self.data_queue.get()
+            if received is None:
+                break
+            for frame in received:
+                self.writer.write(frame)
+        self.writer.release()
+
+    def finish(self):
+        self.data_queue.put(None)
+        self.thread.join()
+
+def render(recording: Recording, out_path: str, display: DisplayMethod, workers: int, batch_size: int):
+    """
+    表示方法に合わせて合成した動画を書き出す
+    デコードと合成はバッチごとに同じワーカープロセスで行い、合成したフレームだけを受け取ってエンコードする
+    """
+    render_start = time.time()
+    config = recording.config
+    height = config.height * 2 if display == DisplayMethod.STACK else config.height
+    write_thread = WriteThread(out_path, config.frequency, (config.width, height), workers * 2)
+    write_thread.start()
+
+    frame_count = 0
+    try:
+        render_batch = partial(_render_batch, display, len(recording), config.frequency)
+        for rendered in recording.map_batches(render_batch, batch_size, workers):
+            write_thread.data_queue.put(rendered)
+            frame_count += rendered.shape[0]
+    finally:
+        write_thread.finish()
+
+    elapsed = max(time.time() - render_start, 1e-6)
+    print(f"rendered: {out_path} {frame_count}f {elapsed:.1f}s {frame_count / elapsed:.1f}fps ({frame_count / elapsed / config.frequency:.1f}x)")
+    return frame_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="+", help="configuration file path or directory")
+    parser.add_argument("-o", "--out", default=".", help="out directory")
+    parser.add_argument("-d", "--display", default="stack", choices={"stack", "blend"}, help="display method")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("-b", "--batch", type=int, default=DEPTH_CHUNK_FRAMES, help="frames per batch")
+    args = parser.parse_args()
+    display = DisplayMethod.STACK if args.display == "stack" else DisplayMethod.BLEND
+
+    if os.path.exists(args.out) is False:
+        os.makedirs(args.out)
+
+    total_start = time.time()
+    total_frames = 0
+    for json_path in find_recordings(args.path):
+        with Recording(json_path) as recording:
+            name = os.path.splitext(os.path.basename(json_path))[0]
+            out_path = os.path.join(args.out, f"{name}-{args.display}.avi")
+            total_frames += render(recording, out_path, display, args.jobs, args.batch)
+    elapsed = max(time.time() - total_start, 1e-6)
+    print(f"total: {total_frames}f {elapsed:.1f}s {total_frames / elapsed:.1f}fps")
@@ -0,0 +1,82 @@
+import time
+import numpy as np
+
+# 合成ソースで使える(幅, 高さ, fps)の一覧(D400シリーズのColor/Depthに共通する主なもの)
+SYNTHETIC_PROFILES = [
+    (width, height, fps)
+    for width, height in [(424, 240), (640, 360), (640, 480), (848, 480), (1280, 720)]
+    for fps in [6, 15, 30]
+]
+
+class SyntheticSource():
+    """
+    Realsenseの代わりに合成したフレームを出力するソース(カメラなしでの動作確認用)
+    読み出しが間に合わなかったフレームは実機と同様にドロップ扱いになる
+    """
+    def __init__(self, width: int, height: int, frequency: int) -> None:
+        self.width = width
+        self.height = height
+        self.frequency = frequency
+        self.start_time = None
+        self.next_frame_number = 0
+        self.depth_scale = 0.001
+
+        # 横方向のグラデーションと、中心からの距離に応じたDepthを用意しておき、毎フレームずらして使う
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)
+        self.base_color = np.zeros((height, width, 3), dtype=np.uint8)
+        self.base_color[:,:,0] = x[np.newaxis,:]
+        self.base_color[:,:,1] = y[:,np.newaxis]
+        self.base_color[:,:,2] = 128
+        xx, yy = np.meshgrid(np.arange(width) - width / 2, np.arange(height) - height / 2)
+        self.base_depth = (500 + np.sqrt(xx ** 2 + yy ** 2) * 4).astype(np.uint16)
+
+    def intrinsics(self) -> dict:
+        return {
+            "fx": float(self.width),
+            "fy": float(self.width),
+            "ppx": self.width / 2,
+            "ppy": self.height / 2,
+            "width": self.width,
+            "height": self.height,
+            "model": "distortion.none",
+            "coeffs": [0.0, 0.0, 0.0, 0.0, 0.0]
+        }
+
+    def start(self):
+        """
+        ストリーミングを開始し、(Colorの内部パラメータ, Depthの内部パラメータ)を返す
+        """
+        self.start_time = time.time()
+        self.next_frame_number = 0
+        return self.intrinsics(), self.intrinsics()
+
+    def read(self):
+        """
+        次のフレームを待って(Color画像, Depth画像, タイムスタンプ[ms], フレーム番号)を返す
+        """
+        frame_time = self.start_time + self.next_frame_number / self.frequency
+        now = time.time()
+        if now < frame_time:
+            time.sleep(frame_time - now)
+            frame_number = self.next_frame_number
+        else:
+            # 読み出しが遅れた分のフレームは捨てられる
+            frame_number = int((now - self.start_time) * self.frequency)
+        self.next_frame_number = frame_number + 1
+
+        shift = frame_number * 4 % self.width
+        color_image = np.roll(self.base_color, shift, axis=1)
+        depth_image = np.roll(self.base_depth, shift, axis=1)
+        timestamp = (self.start_time + frame_number / self.frequency) * 1000
+        return color_image, depth_image, timestamp, frame_number
+
+    def stop(self):
+        self.start_time = None
+
+    @staticmethod
+    def query_profiles():
+        """
+        シリアル番号と使える(幅, 高さ, fps)の一覧を返す
+        """
+        return "synthetic", list(SYNTHETIC_PROFILES)
@@ -1,86 +1,79 @@
 import argparse
 import time
-import json
-import os
 import cv2
-import numpy as np
 
-from common import DisplayMethod
+from common import DisplayMethod, compose_view
+from proxy import upsample
+from recording import Recording
 
-def watch_frames(color_file: str, depth_file: str, frequency: int, display: DisplayMethod):
+# キー操作が止まってからフル解像度に切り替えるまでの秒数
+FULL_RESOLUTION_DELAY = 0.3
+
+def watch_frames(recording: Recording, display: DisplayMethod, use_proxy: bool = True):
     """
     動画データをページ送りする
+    プロキシがある場合、ページ送り中はプロキシを表示し、止まったらフル解像度に切り替える
     """
-    video = cv2.VideoCapture(color_file)
-
-    depth_frames = np.load(depth_file)
-    depth_frames = depth_frames[depth_frames.files[0]]
+    size = (recording.config.width, recording.config.height)
+    frame_num = len(recording)
+    proxy = recording.proxy() if use_proxy else None
 
     current_frame = 0
 
     color_frame = None
-
-    print(np.linalg.norm(depth_frames[0,:,:] - depth_frames[-1,:,:]))
-
-    color_frames = []
+    depth_frame = None
+    is_full_resolution = False
+    last_key_time = time.time()
 
     try:
         while True:
-            if color_frame is None:
-                if current_frame < len(color_frames):
-                    color_frame = color_frames[current_frame]
-                else:
-                    ret, color_frame = video.read()
-                    color_frames.append(color_frame)
-            depth_frame = depth_frames[current_frame,:,:]
+            if proxy is None:
+                if color_frame is None:
+                    color_frame, depth_frame = recording[current_frame]
+            elif color_frame is None:
+                proxy_color, proxy_depth = proxy[current_frame]
+                color_frame = upsample(proxy_color, size)
+                depth_frame = upsample(proxy_depth, size)
+                is_full_resolution = False
+            elif not is_full_resolution and time.time() - last_key_time > FULL_RESOLUTION_DELAY:
+                # ページ送りが止まったのでフル解像度のフレームを読み込む
+                color_frame, depth_frame = recording[current_frame]
+                is_full_resolution = True
 
-            depth_colormap = cv2.applyColorMap(
-                cv2.convertScaleAbs(depth_frame, alpha=0.08), cv2.COLORMAP_JET
-            )
-            
-            color_frame = cv2.putText(
-                color_frame, f"{current_frame+1}/{depth_frames.shape[0]}f",(10,50),
+            view_frame = cv2.putText(
+                color_frame.copy(), f"{current_frame+1}/{frame_num}f",(10,50),
                 cv2.FONT_HERSHEY_PLAIN, 2, (0,0,200), 3
             )
             cv2.namedWindow("Watch Frames", cv2.WINDOW_AUTOSIZE)
-            if display == DisplayMethod.STACK:
-                cv2.imshow("Watch Frames", np.vstack((depth_colormap, color_frame)))
-            else:
-                img_mask = cv2.bitwise_not(cv2.inRange(depth_colormap, np.array([128,0,0]), np.array([128,0,0])))
-                depth_colormap = cv2.bitwise_and(depth_colormap, depth_colormap, mask=img_mask)
-
-                blended = cv2.addWeighted(color_frame, 0.5, depth_colormap, 0.5, 0)
-                cv2.imshow("Watch Frames", blended)
+            cv2.imshow("Watch Frames", compose_view(view_frame, depth_frame, display))
 
             k = cv2.waitKey(1)
             if k & 0xff == 27:
                 cv2.destroyAllWindows()
                 break
-            if k & 0xff == ord("d") and current_frame < depth_frames.shape[0] - 1:
+            if k & 0xff == ord("d") and current_frame < frame_num - 1:
                 color_frame = None
                 current_frame += 1
+                last_key_time = time.time()
                 continue
             if k & 0xff == ord("a") and current_frame > 0:
                 color_frame = None
                 current_frame -= 1
+                last_key_time = time.time()
                 continue
     finally:
-        video.release()
+        recording.close()
+        if proxy is not None:
+            proxy.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("json", help="configuration file path")
     parser.add_argument("-d", "--display", default="stack", choices={"stack", "blend"}, help="display method")
+    parser.add_argument("--no-proxy", action="store_true", help="always show full resolution frames")
     args = parser.parse_args()
-    json_path = args.json
-    dir = os.path.split(os.path.abspath(json_path))[0]
-    with open(json_path) as f:
-        config = json.load(f)
-        print(config)
-
-    color_path = os.path.join(dir, config["color_file"])
-    depth_path = os.path.join(dir, config["depth_file"])
-    frequency = config["frequency"]
+    recording = Recording(args.json)
+    print(recording.config.toJson())
     display = DisplayMethod.STACK if args.display == "stack" else DisplayMethod.BLEND
 
-    watch_frames(color_path, depth_path, frequency, display)
+    watch_frames(recording, display, not args.no_proxy)
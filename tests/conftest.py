@@ -0,0 +1,5 @@
+import os
+import sys
+
+# hayakawaのスクリプトはディレクトリ内で実行する前提でimportしているため、パスに追加する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hayakawa"))
@@ -0,0 +1,100 @@
+import multiprocessing
+import time
+import uuid
+import numpy as np
+
+from frame_bus import FrameBusPublisher, FrameBusSubscriber, DEFAULT_SLOTS
+from synthetic import SyntheticSource
+
+WIDTH = 160
+HEIGHT = 120
+FREQUENCY = 120
+FRAMES = 60
+
+def subscribe(name, ready, results):
+    """
+    最後のフレームまで読み、(通し番号, フレーム番号, 内容が正しいか)の一覧を返す
+    """
+    source = SyntheticSource(WIDTH, HEIGHT, FREQUENCY)
+    subscriber = FrameBusSubscriber(name)
+    ready.set()
+    received = []
+    last_seq = 0
+    deadline = time.time() + 10
+    try:
+        while last_seq < FRAMES and time.time() < deadline:
+            frame = subscriber.wait_next(last_seq)
+            if frame is None:
+                continue
+            shift = frame.frame_number * 4 % WIDTH
+            matched = (
+                np.array_equal(frame.depth, np.roll(source.base_depth, shift, axis=1))
+                and np.array_equal(frame.color, np.roll(source.base_color, shift, axis=1))
+            )
+            # 比較中に上書きされていたら内容は判定しない
+            if subscriber.is_valid(frame):
+                received.append((frame.seq, frame.frame_number, matched))
+            last_seq = frame.seq
+            del frame
+    finally:
+        subscriber.close()
+    results.put(received)
+
+def test_subscribers_read_synthetic_frames():
+    name = f"rsbus_{uuid.uuid4().hex[:8]}"
+    context = multiprocessing.get_context("spawn")
+    source = SyntheticSource(WIDTH, HEIGHT, FREQUENCY)
+    publisher = FrameBusPublisher(name, WIDTH, HEIGHT)
+    results = context.Queue()
+    readies = [context.Event() for _ in range(2)]
+    processes = [context.Process(target=subscribe, args=(name, ready, results)) for ready in readies]
+    try:
+        for process in processes:
+            process.start()
+        for ready in readies:
+            assert ready.wait(30)
+
+        source.start()
+        for _ in range(FRAMES):
+            color_image, depth_image, timestamp, frame_number = source.read()
+            publisher.publish(color_image, depth_image, timestamp, frame_number)
+
+        received = [results.get(timeout=30) for _ in processes]
+        for process in processes:
+            process.join(10)
+            assert process.exitcode == 0
+    finally:
+        source.stop()
+        publisher.close()
+
+    for frames in received:
+        assert len(frames) > 0
+        seqs = [seq for seq, _, _ in frames]
+        assert seqs == sorted(set(seqs))
+        assert seqs[-1] == FRAMES
+        assert all(matched for _, _, matched in frames)
+
+def test_frame_becomes_invalid_after_ring_wraps():
+    name = f"rsbus_{uuid.uuid4().hex[:8]}"
+    source = SyntheticSource(WIDTH, HEIGHT, 1000)
+    publisher = FrameBusPublisher(name, WIDTH, HEIGHT)
+    subscriber = FrameBusSubscriber(name)
+    try:
+        source.start()
+        color_image, depth_image, timestamp, frame_number = source.read()
+        publisher.publish(color_image, depth_image, timestamp, frame_number)
+        frame = subscriber.read_latest()
+        assert frame.seq == 1
+        assert subscriber.is_valid(frame)
+
+        for _ in range(DEFAULT_SLOTS - 1):
+            publisher.publish(*source.read())
+        assert subscriber.is_valid(frame)
+
+        publisher.publish(*source.read())
+        assert not subscriber.is_valid(frame)
+        del frame
+    finally:
+        source.stop()
+        subscriber.close()
+        publisher.close()
@@ -0,0 +1,200 @@
+import os
+import zipfile
+import cv2
+import numpy as np
+import pytest
+
+from common import DisplayMethod, DepthReader, RecorderConfig, save_depth
+from migrate_depth import migrate_depth_file
+from proxy import downsample_depth, make_proxy
+from recording import Recording
+from synthetic import SyntheticSource
+
+WIDTH = 64
+HEIGHT = 48
+FREQUENCY = 10
+FRAMES = 70
+
+def make_depths():
+    return np.random.RandomState(0).randint(0, 5000, (FRAMES, HEIGHT, WIDTH)).astype(np.uint16)
+
+def write_single_array_zip64(depth_path, depths):
+    # 以前のmigrate_depth.pyと同じ形式(1つの配列をzip64で圧縮)
+    with zipfile.ZipFile(depth_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open("arr_0.npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, depths)
+
+# Depthの保存形式: チャンクごと(現在の形式)と以前の形式(1つの配列)
+DEPTH_FORMATS = {
+    "chunked": lambda path, depths: save_depth(path, depths, 16),
+    "stored": lambda path, depths: np.savez(path, depths),
+    "deflated": lambda path, depths: np.savez_compressed(path, depths),
+    "float64": lambda path, depths: np.savez_compressed(path, depths.astype(np.float64)),
+    "zip64": write_single_array_zip64,
+}
+
+def make_recording(dir, depth_format="chunked"):
+    """
+    フレームごとに異なるColorと乱数のDepthを持つ録画データを作り、(JSONのパス, Depth)を返す
+    """
+    intrinsics = SyntheticSource(WIDTH, HEIGHT, FREQUENCY).intrinsics()
+    config = RecorderConfig(WIDTH, HEIGHT, FRAMES / FREQUENCY, FREQUENCY, DisplayMethod.STACK, intrinsics, intrinsics)
+    config.time_str = "test"
+    config.depth_file = "test-depth.npz"
+    config.color_file = "test-rgb.avi"
+
+    writer = cv2.VideoWriter(os.path.join(dir, config.color_file), cv2.VideoWriter_fourcc(*"mp4v"), FREQUENCY, (WIDTH, HEIGHT))
+    for i in range(FRAMES):
+        color = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        color[:,:,0] = i * 3
+        color[:,:,1] = np.arange(WIDTH, dtype=np.uint8)[np.newaxis,:] * 4
+        writer.write(color)
+    writer.release()
+
+    depths = make_depths()
+    DEPTH_FORMATS[depth_format](os.path.join(dir, config.depth_file), depths)
+    json_path = os.path.join(dir, "test.json")
+    with open(json_path, "w") as f:
+        f.write(config.toJson())
+    return json_path, depths
+
+def first_frame_and_size(colors, depths, first_frame):
+    return first_frame, colors.shape[0], depths.shape[0]
+
+def write_nothing(colors, depths, first_frame):
+    return None
+
+@pytest.mark.parametrize("depth_format", sorted(DEPTH_FORMATS))
+def test_depth_reader_reads_any_range(tmp_path, depth_format):
+    depths = make_depths()
+    depth_path = str(tmp_path / "depth.npz")
+    DEPTH_FORMATS[depth_format](depth_path, depths)
+    reader = DepthReader(depth_path, block_frames=8)
+    try:
+        assert reader.total_frames == FRAMES
+        rand = np.random.RandomState(1)
+        for _ in range(30):
+            start = rand.randint(0, FRAMES)
+            end = start + rand.randint(1, 40)
+            result = reader.read(start, end)
+            assert result.dtype == np.uint16
+            assert np.array_equal(result, depths[start:end])
+        # 前後に飛びながら1フレームずつ読む
+        for index in [69, 0, 35, 34, 17, 68, 1]:
+            assert np.array_equal(reader.frame(index), depths[index])
+        with pytest.raises(IndexError):
+            reader.frame(FRAMES)
+    finally:
+        reader.close()
+
+def test_depth_reader_skips_in_small_reads(tmp_path, monkeypatch):
+    # 以前の形式は読み捨てながら進むため、読み捨てが複数回に分かれる場合を確かめる
+    monkeypatch.setattr(DepthReader, "READ_BYTES", 1000)
+    depths = make_depths()
+    depth_path = str(tmp_path / "depth.npz")
+    np.savez_compressed(depth_path, depths)
+    reader = DepthReader(depth_path)
+    try:
+        assert np.array_equal(reader.read(60, 70), depths[60:70])
+        assert np.array_equal(reader.read(5, 6), depths[5:6])
+    finally:
+        reader.close()
+
+def test_save_depth_writes_chunks(tmp_path):
+    depths = make_depths()
+    depth_path = str(tmp_path / "depth.npz")
+    save_depth(depth_path, depths, 16)
+    archive = np.load(depth_path)
+    assert archive.files == ["arr_0", "arr_1", "arr_2", "arr_3", "arr_4"]
+    assert np.array_equal(np.concatenate([archive[name] for name in archive.files]), depths)
+    archive.close()
+
+@pytest.mark.parametrize("depth_format", ["float64", "zip64"])
+def test_migrate_depth_file_converts_to_chunks(tmp_path, depth_format):
+    depths = make_depths()
+    depth_path = str(tmp_path / "depth.npz")
+    DEPTH_FORMATS[depth_format](depth_path, depths)
+    assert migrate_depth_file(depth_path, 16)
+    reader = DepthReader(depth_path)
+    try:
+        assert len(reader.members) == 5
+        assert reader.dtype == np.uint16
+        assert np.array_equal(reader.read(0, FRAMES), depths)
+    finally:
+        reader.close()
+    assert not migrate_depth_file(depth_path, 16)
+
+def test_recording_index_slice_and_time_range(tmp_path):
+    json_path, depths = make_recording(str(tmp_path))
+    with Recording(json_path) as recording:
+        assert len(recording) == FRAMES
+        colors = [color for color, _ in recording.iter_frames()]
+        assert len(colors) == FRAMES
+
+        for index in [50, 3, 69, 0, 33]:
+            color, depth = recording[index]
+            assert np.array_equal(color, colors[index])
+            assert np.array_equal(depth, depths[index])
+        assert np.array_equal(recording[-1][1], depths[-1])
+        with pytest.raises(IndexError):
+            recording[FRAMES]
+
+        part = recording[10:40]
+        assert len(part) == 30
+        assert np.array_equal(part[0][1], depths[10])
+        inner = part[5:]
+        assert len(inner) == 25
+        assert np.array_equal(inner[0][1], depths[15])
+        assert np.array_equal(inner[-1][0], colors[39])
+
+        timed = recording.time_range(2.0, 3.5)
+        assert (timed.start, timed.end) == (20, 35)
+        assert np.array_equal(timed[0][1], depths[20])
+        assert len(recording.time_range(6.5)) == 5
+
+@pytest.mark.parametrize("depth_format", ["chunked", "deflated"])
+def test_iter_batches_matches_sequential_decode(tmp_path, depth_format):
+    json_path, depths = make_recording(str(tmp_path), depth_format)
+    with Recording(json_path) as recording:
+        part = recording[7:65]
+        sequential = list(part.iter_frames())
+        batches = list(part.iter_batches(batch_size=10, workers=2))
+        part.close()
+
+    # バッチの区切りはファイルの先頭から10フレームごと
+    assert [colors.shape[0] for colors, _ in batches] == [3, 10, 10, 10, 10, 10, 5]
+    colors = np.concatenate([colors for colors, _ in batches])
+    batch_depths = np.concatenate([depths for _, depths in batches])
+    assert len(colors) == len(sequential)
+    for i, (color, depth) in enumerate(sequential):
+        assert np.array_equal(colors[i], color)
+        assert np.array_equal(batch_depths[i], depth)
+    assert np.array_equal(batch_depths, depths[7:65])
+
+def test_map_batches_keeps_order(tmp_path):
+    json_path, _ = make_recording(str(tmp_path))
+    with Recording(json_path) as recording:
+        results = list(recording.map_batches(first_frame_and_size, batch_size=16, workers=3, prefetch=1))
+        assert results == [(0, 16, 16), (16, 16, 16), (32, 16, 16), (48, 16, 16), (64, 6, 6)]
+
+        # Noneを返す関数でも最後のバッチまで処理する
+        assert len(list(recording.map_batches(write_nothing, batch_size=10, workers=2))) == 7
+
+        # 途中で抜けても次の呼び出しは最初から処理する
+        for _ in recording.iter_batches(batch_size=10, workers=2):
+            break
+        assert [first for first, _, _ in recording.map_batches(first_frame_and_size, batch_size=10, workers=2)] == list(range(0, FRAMES, 10))
+
+def test_proxy_reads_downsampled_frames(tmp_path):
+    json_path, depths = make_recording(str(tmp_path))
+    make_proxy(json_path)
+    with Recording(json_path) as recording:
+        proxy = recording[20:30].proxy()
+        try:
+            assert len(proxy) == 10
+            for index in [9, 0, 4]:
+                color, depth = proxy[index]
+                assert color.shape == (HEIGHT // 2, WIDTH // 2, 3)
+                assert np.array_equal(depth, downsample_depth(depths[20 + index], (WIDTH // 2, HEIGHT // 2)))
+        finally:
+            proxy.close()